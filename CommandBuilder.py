@@ -25,3 +25,9 @@ class CommandBuilder(object):
     def run(self, replaceForeground=False):
         return Utils.run(*self.command_args,
                          replaceForeground=replaceForeground)
+
+    def stream(self):
+        return Utils.stream(*self.command_args)
+
+    def background(self):
+        return Utils.background(*self.command_args)
@@ -1,5 +1,9 @@
 import os
+import re
 import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from PortAllocator import parse_port
 from Utils import printe
 
 required_fields = [
@@ -45,11 +49,75 @@ optional_container_fields = {
 }
 
 
+# Field names allowed in each config type, as sets for constant-time lookups.
+container_fields = frozenset(required_fields + required_container_fields +
+                             list(optional_container_fields))
+machine_fields = frozenset(required_fields + required_machine_fields +
+                           list(optional_machine_fields))
+
+# Bump when the checks below change so cached validation results expire.
+validation_version = '3'
+validation_cache_file = '.validate-cache'
+
+
+def check_config(config, configJson):
+    """Returns the problems found in a single parsed config file"""
+    if not isinstance(configJson, dict):
+        return ['Config %s is not a JSON object.' % config]
+    errors = []
+    for field in required_fields:
+        if field not in configJson:
+            errors += ['Config %s is missing its %s.' % (config, field)]
+        elif not isinstance(configJson[field], str):
+            errors += ['Config %s has a %s that is not a string.' % (
+                config, field)]
+    if errors:
+        return errors
+    if configJson['type'] == 'container':
+        for field in configJson:
+            if field not in container_fields:
+                errors += ['Container config {config} has unknown field '
+                           '"{field}".'.format(config=config, field=field)]
+        for field in required_container_fields:
+            if field not in configJson:
+                errors += ['Container config {config} is missing its '
+                           '{field}.'.format(config=config, field=field)]
+    elif configJson['type'] == 'machine':
+        for field in configJson:
+            if field not in machine_fields:
+                errors += ['Machine config {config} has unknown field '
+                           '"{field}".'.format(config=config, field=field)]
+        for field in required_machine_fields:
+            if field not in configJson:
+                errors += ['Machine config {config} is missing its '
+                           '{field}.'.format(config=config, field=field)]
+    else:
+        errors += ['Unknown type "{}". Available types are: container, '
+                   'machine'.format(configJson['type'])]
+    return errors
+
+
+def fill_defaults(configJson):
+    if configJson['type'] == 'container':
+        defaults = optional_container_fields
+    else:
+        defaults = optional_machine_fields
+    for field in defaults:
+        if field not in configJson:
+            configJson[field] = defaults[field]
+    return configJson
+
+
+def expand_directory(config_directory):
+    if config_directory.startswith('~'):
+        config_directory = os.path.expanduser('~') + config_directory[1:]
+    return config_directory
+
+
 class ConfigManager(object):
 
     def __init__(self, config_directory, filter=None):
-        if config_directory.startswith('~'):
-            config_directory = os.path.expanduser('~') + config_directory[1:]
+        config_directory = expand_directory(config_directory)
         if not os.path.exists(config_directory):
             os.makedirs(config_directory)
         try:
@@ -65,47 +133,9 @@ class ConfigManager(object):
                 configJson = json.load(file)
             if filter and configJson['type'] != filter:
                 continue
-            for field in required_fields:
-                if field not in configJson:
-                    printe('Config %s is missing its %s.' % (config, field),
-                           terminate=3)
-            if configJson['type'] == 'container':
-                all_fields = list(required_fields)
-                all_fields += required_container_fields
-                all_fields += optional_container_fields
-                for field in configJson:
-                    if field not in all_fields:
-                        printe('Container config {config} has unknown field '
-                               '"{field}".'.format(config=config, field=field),
-                               terminate=3)
-                for field in required_container_fields:
-                    if field not in configJson:
-                        printe('Container config {config} is missing its '
-                               'field.'.format(config=config, field=field),
-                               terminate=3)
-                for field in optional_container_fields:
-                    if field not in configJson:
-                        configJson[field] = optional_container_fields[field]
-            elif configJson['type'] == 'machine':
-                all_fields = list(required_fields)
-                all_fields += required_machine_fields
-                all_fields += optional_machine_fields
-                for field in configJson:
-                    if field not in all_fields:
-                        printe('Machine config {config} has unknown field '
-                               '"{field}".'.format(config=config, field=field),
-                               terminate=3)
-                for field in required_machine_fields:
-                    if field not in configJson:
-                        printe('Machine config {config} is missing its '
-                               '{field}.'.format(config=config, field=field),
-                               terminate=3)
-                for field in optional_machine_fields:
-                    if field not in configJson:
-                        configJson[field] = optional_machine_fields[field]
-            else:
-                printe('Unknown type "{}". Available types are: container, '
-                       'machine'.format(configJson['type']), terminate=3)
+            for error in check_config(config, configJson):
+                printe(error, terminate=3)
+            fill_defaults(configJson)
             config_type = configJson['type']
             kind = configJson['kind']
             flavor = configJson['flavor']
@@ -168,3 +198,158 @@ class ConfigManager(object):
             for flavor in self.configs[config_type][kind]:
                 ls += ['%s:%s' % (kind, flavor)]
         return ls
+
+
+def validate_file(config, text):
+    """
+    Checks one config file on its own. Returns its errors along with the
+    fields needed for the checks that span the whole directory.
+    """
+    result = {'errors': []}
+    try:
+        configJson = json.loads(text)
+    except ValueError as e:
+        result['errors'] += ['Config %s is not valid JSON: %s' % (config, e)]
+        return result
+    result['errors'] += check_config(config, configJson)
+    if not isinstance(configJson, dict) \
+            or any(not isinstance(configJson.get(field), str)
+                   for field in required_fields) \
+            or configJson['type'] not in ('container', 'machine'):
+        return result
+    for field in ('type', 'kind', 'flavor', 'name'):
+        result[field] = configJson[field]
+    if configJson['type'] != 'container':
+        return result
+    links = configJson.get('links', [])
+    ports = configJson.get('ports', [])
+    volumes_from = configJson.get('volumes-from')
+    if not isinstance(links, list):
+        result['errors'] += ['Container config %s has links that are not a '
+                             'list.' % config]
+        links = []
+    if not isinstance(ports, list):
+        result['errors'] += ['Container config %s has ports that are not a '
+                             'list.' % config]
+        ports = []
+    result['links'] = []
+    for link in links:
+        if not isinstance(link, str) or not re.match(r'.+:.+', link):
+            result['errors'] += ['Container config {config} has link "{link}"'
+                                 ' without both a container name and an '
+                                 'alias.'.format(config=config, link=link)]
+        else:
+            result['links'] += [link.partition(':')[0]]
+    for port in ports:
+        if not parse_port(port):
+            result['errors'] += ['Container config {config} has malformed '
+                                 'port "{port}".'.format(config=config,
+                                                         port=port)]
+    if volumes_from is not None:
+        if not isinstance(volumes_from, str):
+            result['errors'] += ['Container config %s has volumes-from that '
+                                 'is not a string.' % config]
+        else:
+            result['volumes-from'] = volumes_from.partition(':')[0]
+    return result
+
+
+def validate_files(files):
+    return [validate_file(config, text) for config, text in files]
+
+
+def validate(config_directory, workers=None):
+    """
+    Checks every config in the directory and returns (errors, warnings).
+    Per-file results are cached by content hash, so only changed files are
+    checked again. Those are spread across worker processes.
+
+    Links and volumes-from name containers, which are only named when they
+    are created. As a heuristic, targets matching no container config's name
+    or kind are reported as warnings rather than errors.
+    """
+    config_directory = expand_directory(config_directory)
+    try:
+        configs = sorted(name for name in os.listdir(config_directory)
+                         if name.endswith('.json'))
+    except OSError:
+        printe('Could not list files in the directory:', config_directory,
+               terminate=True)
+    cache_path = os.path.join(config_directory, validation_cache_file)
+    try:
+        with open(cache_path) as file:
+            cache = json.load(file)
+        if cache.get('version') != validation_version:
+            cache = {}
+    except (OSError, ValueError):
+        cache = {}
+    cached = cache.get('results', {})
+
+    hashes = {}
+    pending = []
+    for config in configs:
+        with open(os.path.join(config_directory, config), 'rb') as file:
+            content = file.read()
+        digest = hashlib.sha1(config.encode() + b'\0' + content).hexdigest()
+        hashes[config] = digest
+        if digest not in cached:
+            pending += [(config, content.decode('utf-8', 'replace'))]
+
+    if pending:
+        workers = workers or os.cpu_count() or 1
+        chunk_size = max(1, len(pending) // (workers * 4))
+        chunks = [pending[i:i + chunk_size]
+                  for i in range(0, len(pending), chunk_size)]
+        if workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                checked = [result for chunk in executor.map(validate_files,
+                                                            chunks)
+                           for result in chunk]
+        else:
+            checked = validate_files(pending)
+        for (config, _), result in zip(pending, checked):
+            cached[hashes[config]] = result
+
+    results = dict((config, cached[hashes[config]]) for config in configs)
+    try:
+        with open(cache_path + '.tmp', 'w') as file:
+            json.dump({
+                'version': validation_version,
+                'results': dict((hashes[config], results[config])
+                                for config in configs),
+            }, file)
+        os.replace(cache_path + '.tmp', cache_path)
+    except OSError:
+        printe('Could not write the validation cache:', cache_path)
+
+    errors = []
+    seen = {}
+    names = set()
+    for config in configs:
+        result = results[config]
+        errors += result['errors']
+        if 'kind' not in result:
+            continue
+        if result['type'] == 'container':
+            names.update((result['name'], result['kind']))
+        key = (result['type'], result['kind'], result['flavor'])
+        if key in seen:
+            errors += ['Duplicate kind:flavor configs found: {file} {config}.'
+                       .format(file=seen[key], config=config)]
+        else:
+            seen[key] = config
+    warnings = []
+    for config in configs:
+        result = results[config]
+        for link in result.get('links', []):
+            if link not in names:
+                warnings += ['Container config {config} links to "{link}", '
+                             'which is not the name or kind of any container '
+                             'config.'.format(config=config, link=link)]
+        volumes_from = result.get('volumes-from')
+        if volumes_from is not None and volumes_from not in names:
+            warnings += ['Container config {config} takes volumes from '
+                         '"{name}", which is not the name or kind of any '
+                         'container config.'.format(config=config,
+                                                    name=volumes_from)]
+    return (errors, warnings)
@@ -1,14 +1,25 @@
 #!/usr/bin/env python3
 from CommandBuilder import CommandBuilder
 from ConfigManager import ConfigManager, required_fields, \
-    required_container_fields
+    required_container_fields, validate
 from DockerMachine import DockerMachine
+import PortAllocator
+from StatsSampler import StatsSampler
 from Utils import printe
 import Utils
 import argparse
 import os
+import sys
 import re
 import json
+import fnmatch
+import queue
+import threading
+import time
+
+# Labels recording the config a container was created from.
+kind_label = 'lazy-docker.kind'
+flavor_label = 'lazy-docker.flavor'
 
 
 class DockerContainer(object):
@@ -21,7 +32,9 @@ class DockerContainer(object):
             self.machine = DockerMachine(machine)
 
     def base_command(self):
-        return CommandBuilder('docker')
+        if self.machine is None:
+            return CommandBuilder('docker')
+        return self.machine.docker_command()
 
     def create(self, image, *command_args, **config):
         command = self.base_command()
@@ -71,11 +84,22 @@ class DockerContainer(object):
             command.append('--net', config.get('net'))
         if config.get('ports') is not None:
             ip = self.machine.ip() if self.machine is not None else None
-            for port in config.get('ports'):
-                if not re.match(r'.+:.+', port):
-                    printe('Error: In {name}, the port "{port}" does not '
-                           'contain both internal and external port.'
-                           .format(self.name, port), terminate=True)
+            ports = config.get('ports')
+            for port in ports:
+                if not PortAllocator.parse_port(port):
+                    printe('Error: In {name}, the port "{port}" is not of '
+                           'the form [ip:][host]:container with host and '
+                           'container ranges of the same length.'
+                           .format(name=self.name, port=port), terminate=True)
+            # Running binds fixed host ports now, so check them for conflicts
+            # too; a created container only binds them once started.
+            run = config.get('run') is True
+            if any(PortAllocator.needs_allocation(port) or
+                   run and PortAllocator.parse_port(port).group('host')
+                   for port in ports):
+                ports = PortAllocator.for_machine(self.machine).allocate(
+                    *ports, bind=run)
+            for port in ports:
                 if ip and port.startswith(':'):
                     port = ip + port
                 command.append('-p', port)
@@ -85,6 +109,8 @@ class DockerContainer(object):
             command.append('--volume', volume)
         if config.get('volumes-from') is not None:
             command.append('--volumes-from', config.get('volumes-from'))
+        for label, value in config.get('labels', dict()).items():
+            command.append('--label', '%s=%s' % (label, value))
         command.append(image)
 
         pattern = re.compile(r"{{([\w\-_]+)}}")
@@ -126,11 +152,99 @@ class DockerContainer(object):
                                           '{{.NetworkSettings.IPAddress}}',
                                           self.name).run()
 
-    def remove(self, stop_if_running=False):
+    def remove(self, stop_if_running=False, force=False):
+        if force:
+            return self.base_command().append('rm', '--force',
+                                              self.name).run()
         if self.is_running() and stop_if_running:
             self.stop()
         return self.base_command().append('rm', self.name).run()
 
+    def rename(self, new_name):
+        """Renames the container, returning whether that worked"""
+        output = self.base_command().append('rename', self.name,
+                                            new_name).run()
+        if output is None:
+            return False
+        self.name = new_name
+        return True
+
+    def wait(self, *names, timeout=60):
+        """
+        Waits for the named containers to start, and to turn healthy if they
+        have a health check. Follows one `docker events` stream instead of
+        polling, and returns the names that were not ready in time.
+        """
+        if Utils.debugging():
+            return []
+        names = list(names) or [self.name]
+        deadline = Utils.epoch() + timeout
+        # Replaying events since just before the snapshot below means none
+        # are missed while the stream connects.
+        command = self.base_command().append(
+            'events', '--since', '%.3f' % Utils.epoch(),
+            '--filter', 'type=container',
+            '--filter', 'event=start',
+            '--filter', 'event=die',
+            '--filter', 'event=health_status',
+            '--format', '{{json .}}')
+        for name in names:
+            command.append('--filter', 'container=%s' % name)
+        process = command.stream()
+        events = queue.Queue()
+
+        def read():
+            for line in process.stdout:
+                events.put(line)
+            events.put(None)
+        threading.Thread(target=read, daemon=True).start()
+
+        # Containers waiting to start, and ones running but not yet healthy.
+        starting = set(names)
+        unhealthy = set()
+        statuses = self.base_command().append(
+            'ps', '--all', '--format', '{{.Names}}\t{{.Status}}').run()
+        for line in (statuses or '').split('\n'):
+            (name, _, status) = line.partition('\t')
+            if name not in starting or not status.startswith('Up'):
+                continue
+            starting.discard(name)
+            if '(health: starting)' in status or '(unhealthy)' in status:
+                unhealthy.add(name)
+        failed = set()
+        try:
+            while starting or unhealthy:
+                remaining = deadline - Utils.epoch()
+                if remaining <= 0:
+                    break
+                try:
+                    line = events.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if line is None:
+                    break
+                event = json.loads(line)
+                name = event.get('Actor', {}).get('Attributes', {}).get(
+                    'name')
+                action = event.get('Action', event.get('status', ''))
+                if action == 'start' and name in starting:
+                    starting.discard(name)
+                    health = self.base_command().append(
+                        'inspect', '--format',
+                        '{{if .State.Health}}health{{end}}', name).run()
+                    if health:
+                        unhealthy.add(name)
+                elif action == 'health_status: healthy':
+                    unhealthy.discard(name)
+                elif action == 'die' and name in unhealthy:
+                    unhealthy.discard(name)
+                    failed.add(name)
+        finally:
+            process.kill()
+            process.wait()
+        return [name for name in names
+                if name in starting or name in unhealthy or name in failed]
+
     def stop(self):
         return self.base_command().append('stop', self.name).run()
 
@@ -195,9 +309,585 @@ class DockerContainer(object):
             """).run(replaceForeground=True)
 
 
+def create_from_config(config_manager, name, machine, kind, flavor,
+                       run=False, detach=False):
+    config = config_manager.getContainerConfig(kind, flavor)
+    container_config = dict(config)
+    for key in required_fields + required_container_fields:
+        if key in container_config:
+            del container_config[key]
+    container_config['run'] = run
+    container_config['detach'] = detach
+    container_config['labels'] = {kind_label: kind, flavor_label: flavor}
+    return DockerContainer(name, machine).create(
+        config['image'],
+        *config['command'],
+        **container_config
+    )
+
+
+def wait_for(container, *names, timeout=60):
+    waiting = container.wait(*names, timeout=timeout)
+    if waiting:
+        printe('Not ready after {timeout}s: {names}'.format(
+            timeout=timeout, names=', '.join(waiting)), terminate=True)
+
+
+def containers_of_kind(machine, kind, flavor):
+    """Returns the running kind:flavor containers on a machine"""
+    output = DockerContainer(False, machine).base_command().append(
+        'ps',
+        '--filter', 'label=%s=%s' % (kind_label, kind),
+        '--filter', 'label=%s=%s' % (flavor_label, flavor),
+        '--format', '{{.Names}}').run()
+    # Standbys carry the same labels but belong to prestage, not rollout.
+    return [name for name in (output or '').split('\n')
+            if name and not name.startswith(standby_prefix(kind, flavor))]
+
+
+def matches_target(target, name, kind, flavor):
+    if any(char in target for char in '*?['):
+        return fnmatch.fnmatchcase(name, target)
+    if ':' in target:
+        return target == '%s:%s' % (kind, flavor)
+    return target in (name, kind)
+
+
+def list_containers(machine, targets=None):
+    """
+    Returns (name, kind, flavor, status) for the containers on a machine
+    matching any of the targets, or all of them when there are none.
+    """
+    output = DockerContainer(False, machine).base_command().append(
+        'ps', '--all', '--format',
+        '{{.Names}}\t{{.Label "%s"}}\t{{.Label "%s"}}\t{{.Status}}' % (
+            kind_label, flavor_label)).run()
+    containers = []
+    for line in (output or '').split('\n'):
+        fields = line.split('\t')
+        if len(fields) != 4:
+            continue
+        if targets and not any(matches_target(target, *fields[:3])
+                               for target in targets):
+            continue
+        containers += [tuple(fields)]
+    return containers
+
+
+def is_up(status):
+    return status.startswith('Up') or status.startswith('Restarting')
+
+
+def down(machines, targets, grace=10, volumes=False):
+    """
+    Stops and removes the containers matching the targets on each machine.
+    Targets are container names, globs, kinds or kind:flavors; with no
+    targets every container goes. Each machine gets one stop and one rm, and
+    machines are torn down at the same time, so it takes about one grace
+    period in total.
+    """
+    def tear_down(machine):
+        containers = list_containers(machine, targets)
+        matched = [container[0] for container in containers]
+        running = [container[0] for container in containers
+                   if is_up(container[3])]
+        force = False
+        if running:
+            stopped = DockerContainer(False, machine).base_command().append(
+                'stop', '--time', str(int(grace)), *running).run()
+            # Whatever did not stop in time gets killed by rm below.
+            force = stopped is None
+        if not matched:
+            return ([], [])
+        command = DockerContainer(False, machine).base_command().append('rm')
+        if force:
+            command.append('--force')
+        if volumes:
+            command.append('--volumes')
+        if command.append(*matched).run() is not None:
+            return (matched, [])
+        # rm removes what it can and fails on the rest, so look again.
+        remaining = [container[0] for container in list_containers(machine)]
+        left = [name for name in matched if name in remaining]
+        return ([name for name in matched if name not in left], left)
+
+    started = Utils.epoch()
+    results = Utils.parallel(tear_down, machines)
+    for machine, (removed, left) in zip(machines, results):
+        if removed:
+            print('{machine}: {names}'.format(machine=machine or 'local',
+                                              names=' '.join(removed)))
+        if left:
+            printe('{machine}: could not remove {names}'.format(
+                machine=machine or 'local', names=' '.join(left)))
+    printe('Removed {count} containers in {time:.1f}s.'.format(
+        count=sum(len(removed) for removed, _ in results),
+        time=Utils.epoch() - started),
+        terminate=any(left for _, left in results))
+
+
+def stats(machines, targets, window=60, interval=5, duration=None,
+          export=None):
+    """
+    Samples resource use of the running containers matching the targets and
+    prints rolling aggregates by kind:flavor every interval seconds.
+    """
+    sampler = StatsSampler(window=window, export=export)
+    found = Utils.parallel(lambda machine: list_containers(machine, targets),
+                           machines)
+    running = [[(name, '%s:%s' % (kind, flavor) if kind else '-')
+                for name, kind, flavor, status in containers
+                if is_up(status)]
+               for containers in found]
+    if not any(running):
+        printe('No running containers to sample.', terminate=True)
+    for machine, containers in zip(machines, running):
+        sampler.follow(machine, containers)
+    started = Utils.epoch()
+    try:
+        while duration is None or Utils.epoch() - started < duration:
+            wait = interval
+            if duration is not None:
+                wait = min(wait, duration - (Utils.epoch() - started))
+            time.sleep(max(0, wait))
+            print(sampler.report(), end='\n\n', flush=True)
+    except KeyboardInterrupt:
+        print(sampler.report(), flush=True)
+    finally:
+        sampler.stop()
+
+
+def standby_prefix(kind, flavor):
+    return 'lazy-standby.%s.%s.' % (kind, flavor)
+
+
+def standbys(machine, kind, flavor, containers=None):
+    """
+    Returns the kind:flavor containers on a machine named as standbys, out
+    of containers if already listed by list_containers.
+    """
+    prefix = standby_prefix(kind, flavor)
+    if containers is None:
+        containers = list_containers(machine)
+    return [container for container in containers
+            if container[0].startswith(prefix) and
+            matches_target('%s:%s' % (kind, flavor), *container[:3])]
+
+
+def prestage(config_manager, kind, flavor, machines, count=1):
+    """
+    Keeps count created but never started kind:flavor containers on each
+    machine for promote. Their arguments, ports and {{placeholders}} are
+    resolved when they are created, so promoting one only has to start it.
+    """
+    config_manager.getContainerConfig(kind, flavor)
+    prefix = standby_prefix(kind, flavor)
+    found = Utils.parallel(lambda machine: standbys(machine, kind, flavor),
+                           machines)
+    missing = []
+    for machine, containers in zip(machines, found):
+        taken = set(container[0] for container in containers)
+        ready = [container for container in containers
+                 if container[3] == 'Created']
+        index = 0
+        for _ in range(count - len(ready)):
+            while prefix + str(index) in taken:
+                index += 1
+            taken.add(prefix + str(index))
+            missing += [(machine, prefix + str(index))]
+    Utils.parallel(lambda standby: create_from_config(
+        config_manager, standby[1], standby[0], kind, flavor), missing)
+    printe('Staged {count} new {kind}:{flavor} standby container(s).'.format(
+        count=len(missing), kind=kind, flavor=flavor))
+
+
+def promote(config_manager, config_directory, name, kind, flavor,
+            machine=None, count=1, wait=False, timeout=60):
+    """
+    Renames a standby from prestage to name and starts it, then refills the
+    pool in the background. Falls back to a normal run if none is left.
+    """
+    started = Utils.epoch()
+    containers = list_containers(machine)
+    taken = [container for container in containers if container[0] == name]
+    if taken:
+        printe('Error: {name} already exists on {machine} ({status}). '
+               'Remove or rename it before promoting a standby to '
+               'it.'.format(name=name, machine=machine or 'local',
+                            status=taken[0][3]),
+               terminate=True)
+    promoted = False
+    for standby in standbys(machine, kind, flavor, containers):
+        if standby[3] != 'Created':
+            continue
+        container = DockerContainer(standby[0], machine)
+        # Another promote may have taken this standby first.
+        if not container.rename(name):
+            continue
+        if container.start() is None:
+            printe('Could not start {name}.'.format(name=name),
+                   terminate=True)
+        promoted = True
+        break
+    if not promoted:
+        printe('No {kind}:{flavor} standby left on {machine}, creating '
+               '{name} from scratch.'.format(kind=kind, flavor=flavor,
+                                             machine=machine or 'local',
+                                             name=name))
+        if create_from_config(config_manager, name, machine, kind, flavor,
+                              run=True, detach=True) is None:
+            printe('Could not create {name}.'.format(name=name),
+                   terminate=True)
+
+    refill = CommandBuilder(sys.executable, os.path.abspath(__file__),
+                            '--config-dir', config_directory)
+    if machine:
+        refill.append('--machine', machine)
+    refill.append('prestage', '%s:%s' % (kind, flavor),
+                  '--count', str(int(count))).background()
+    if wait:
+        wait_for(DockerContainer(name, machine), timeout=timeout)
+    printe('Promoted {name} in {time:.2f}s.'.format(
+        name=name, time=Utils.epoch() - started))
+
+
+def restage(config_manager, kind, flavor, machines):
+    """Recreates the idle kind:flavor standbys from the current config"""
+    def recreate(machine):
+        idle = [standby[0] for standby in standbys(machine, kind, flavor)
+                if standby[3] == 'Created']
+        if not idle:
+            return
+        if DockerContainer(False, machine).base_command().append(
+                'rm', *idle).run() is None:
+            printe('Could not remove the old standbys on {machine}.'.format(
+                machine=machine or 'local'))
+            return
+        prestage(config_manager, kind, flavor, [machine], count=len(idle))
+    Utils.parallel(recreate, machines)
+
+
+def machine_names(machines, default=None):
+    """Expands a comma separated --machines value into machine names"""
+    if not machines:
+        return [default]
+    names = []
+    for name in machines.split(','):
+        if name == 'all':
+            names += DockerMachine.names()
+        elif name == 'local':
+            names += [None]
+        elif name:
+            names += [name]
+    return names
+
+
+def image_reference(image):
+    """
+    Normalizes an image name the way `docker images` shows it: to
+    repository:tag, or to repository@digest when it is pinned by digest.
+    """
+    (repository, _, digest) = image.partition('@')
+    (name, _, tag) = repository.rpartition(':')
+    if not name or '/' in tag:
+        (name, tag) = (repository, 'latest')
+    for prefix in ('docker.io/', 'library/'):
+        if name.startswith(prefix):
+            name = name[len(prefix):]
+    if digest:
+        return '%s@%s' % (name, digest)
+    return '%s:%s' % (name, tag)
+
+
+def image_repository(reference):
+    """The repository part of a normalized image reference"""
+    if '@' in reference:
+        return reference.partition('@')[0]
+    return reference.rpartition(':')[0]
+
+
+def image_inventory(config_manager, machines):
+    """
+    Lists the images on every machine, merged by image ID. Each image notes
+    the machines holding it and the configs that use it. Images in the
+    repository of a config whose image was found nowhere are noted as maybe
+    used, since that config might still resolve to them.
+    """
+    def list_images(machine):
+        output = DockerContainer(False, machine).base_command().append(
+            'images', '--no-trunc', '--digests', '--format',
+            '{{.Repository}}\t{{.Tag}}\t{{.Digest}}\t{{.ID}}\t{{.Size}}\t'
+            '{{.CreatedAt}}'
+        ).run()
+        rows = []
+        for line in (output or '').split('\n'):
+            fields = line.split('\t')
+            if len(fields) == 6:
+                rows += [fields]
+        return rows
+
+    configs = {}
+    for kind_and_flavor in config_manager.listContainers():
+        (kind, _, flavor) = kind_and_flavor.partition(':')
+        image = config_manager.getContainerConfig(kind, flavor)['image']
+        configs.setdefault(image_reference(image), []).append(kind_and_flavor)
+
+    images = {}
+    resolved = set()
+    for machine, rows in zip(machines, Utils.parallel(list_images,
+                                                      machines)):
+        for repository, tag, digest, image_id, size, created in rows:
+            image = images.setdefault(image_id, {
+                'id': image_id.partition(':')[2][:12] or image_id[:12],
+                'size': Utils.parse_size(size),
+                'created': created,
+                'references': [],
+                'repositories': set(),
+                'machines': {},
+                'configs': [],
+                'maybe': [],
+            })
+            if repository != '<none>':
+                image['repositories'].add(repository)
+            keys = []
+            if repository != '<none>' and tag != '<none>':
+                keys += ['%s:%s' % (repository, tag)]
+            if repository != '<none>' and digest != '<none>':
+                keys += ['%s@%s' % (repository, digest)]
+            # Untagged images pulled by digest are known by their digest.
+            if keys and keys[0] not in image['references']:
+                image['references'] += keys[:1]
+            for key in keys:
+                if key in configs:
+                    resolved.add(key)
+                    image['configs'] += [config for config in configs[key]
+                                         if config not in image['configs']]
+            # What to pass to `docker rmi` to remove this image there.
+            removals = image['machines'].setdefault(machine, [])
+            if repository != '<none>' and tag != '<none>':
+                removals += ['%s:%s' % (repository, tag)]
+            elif not removals:
+                removals += [image_id]
+
+    unresolved = {}
+    for reference in set(configs) - resolved:
+        unresolved.setdefault(image_repository(reference), []).extend(
+            configs[reference])
+    for image in images.values():
+        for repository in image['repositories']:
+            image['maybe'] += unresolved.get(repository, [])
+    return sorted(images.values(), key=lambda image: -image['size'])
+
+
+def images_report(config_manager, machines, prune=False, dry_run=False):
+    images = image_inventory(config_manager, machines)
+    row = '{id:<12}  {size:>9}  {created:<25}  {machines:<20}  {refs}'
+    print(row.format(id='IMAGE ID', size='SIZE', created='CREATED',
+                     machines='MACHINES', refs='REPOSITORY:TAG (CONFIGS)'))
+    unused = []
+    for image in images:
+        if not image['configs'] and not image['maybe']:
+            unused += [image]
+        references = ', '.join(image['references']) or '<none>'
+        if image['configs']:
+            references += ' (%s)' % ', '.join(image['configs'])
+        elif image['maybe']:
+            references += ' (maybe %s)' % ', '.join(image['maybe'])
+        else:
+            references += ' (unused)'
+        print(row.format(
+            id=image['id'],
+            size=Utils.format_size(image['size']),
+            created=image['created'][:25],
+            machines=','.join(machine or 'local'
+                              for machine in image['machines']),
+            refs=references,
+        ))
+    # Image sizes count layers shared with other images again, so this is
+    # only an upper bound on the space pruning frees.
+    reclaimable = sum(image['size'] * len(image['machines'])
+                      for image in unused)
+    printe('{total} images, {unused} used by no config, up to {size} '
+           'reclaimable.'.format(total=len(images), unused=len(unused),
+                                 size=Utils.format_size(reclaimable)))
+    if not prune:
+        return
+
+    removals = dict((machine, []) for machine in machines)
+    for image in unused:
+        for machine, names in image['machines'].items():
+            removals[machine] += names
+
+    def remove_images(machine):
+        if not removals[machine]:
+            return
+        command = DockerContainer(False, machine).base_command().append(
+            'rmi', *removals[machine])
+        if dry_run:
+            print('Would run: %s' % ' '.join(command.command_args))
+            return
+        if command.run() is None:
+            printe('Some images on {machine} could not be removed.'.format(
+                machine=machine or 'local'))
+    Utils.parallel(remove_images, machines)
+
+
+class Replacement(object):
+    """
+    Swaps one container for a fresh one built from its current config.
+    With surge the new container starts next to the old one, otherwise the
+    old one is stopped and moved aside first.
+    """
+
+    def __init__(self, config_manager, kind, flavor, machine, name, surge):
+        self.config_manager = config_manager
+        self.kind = kind
+        self.flavor = flavor
+        self.machine = machine
+        self.name = name
+        self.surge = surge
+        self.old = DockerContainer(name, machine)
+        self.new = DockerContainer(name + '.next' if surge else name, machine)
+        self.moved = False
+        # Set once the new container's name is known to be free for it, so
+        # rollback never removes anything but what create made there.
+        self.attempted = False
+
+    def __str__(self):
+        return '%s@%s' % (self.name, self.machine or 'local')
+
+    def start(self):
+        """Starts the replacement, returning False as soon as a step fails"""
+        if not self.surge:
+            if not self.old.rename(self.name + '.old'):
+                return False
+            self.moved = True
+            if self.old.stop() is None:
+                return False
+        self.attempted = True
+        try:
+            created = create_from_config(self.config_manager, self.new.name,
+                                         self.machine, self.kind,
+                                         self.flavor, run=True, detach=True)
+        except SystemExit:
+            # Config problems, such as port conflicts, are fatal in create.
+            return False
+        return created is not None
+
+    def commit(self):
+        """Removes the old container, returning a problem or None"""
+        if self.old.remove(stop_if_running=True) is None:
+            return 'could not remove %s' % self.old.name
+        if self.surge and not self.new.rename(self.name):
+            return 'the replacement is still running as %s' % self.new.name
+        return None
+
+    def rollback(self):
+        """Restores the old container, returning a problem or None"""
+        if self.attempted:
+            self.new.remove(force=True)
+        if self.moved:
+            if not self.old.rename(self.name):
+                return 'the old container is left as %s' % self.old.name
+            if self.old.start() is None:
+                return 'could not restart %s' % self.name
+        return None
+
+
+def rollout(config_manager, kind, flavor, machines, max_surge=1,
+            max_unavailable=0, timeout=60):
+    """
+    Replaces every running kind:flavor container on the machines in waves of
+    max_surge + max_unavailable. A wave that fails to become ready is rolled
+    back and stops the rollout; earlier waves are kept. Idle standbys are
+    recreated afterwards, still stopped.
+    """
+    config = config_manager.getContainerConfig(kind, flavor)
+    fixed_ports = [port for port in config['ports']
+                   if PortAllocator.parse_port(port)
+                   and PortAllocator.parse_port(port).group('host')
+                   and not PortAllocator.needs_allocation(port)]
+    if max_surge > 0 and fixed_ports:
+        printe('{kind}:{flavor} publishes fixed host ports, so replacements '
+               'cannot start beside the old containers. Replacing them '
+               'without surge.'.format(kind=kind, flavor=flavor))
+        max_unavailable += max_surge
+        max_surge = 0
+    if max_surge < 0 or max_unavailable < 0 \
+            or max_surge + max_unavailable < 1:
+        printe('Max surge and max unavailable must not be negative, and at '
+               'least one of them must be positive.', terminate=2)
+
+    found = Utils.parallel(
+        lambda machine: containers_of_kind(machine, kind, flavor), machines)
+    existing = Utils.parallel(
+        lambda machine: set(container[0] for container in list_containers(
+            machine, ['%s:%s' % (kind, flavor)])),
+        machines)
+    targets = [(machine, name)
+               for machine, names in zip(machines, found)
+               for name in names]
+    # Replacements and moved-aside containers use these names, so leftovers
+    # from an interrupted rollout would be mistaken for this one's.
+    leftovers = ['%s@%s' % (leftover, machine or 'local')
+                 for machine, names in zip(machines, existing)
+                 for leftover in sorted(names)
+                 if leftover.endswith('.next') or leftover.endswith('.old')]
+    if leftovers:
+        printe('Found containers left by an interrupted rollout: {names}. '
+               'Rename or remove them first.'.format(
+                   names=', '.join(leftovers)), terminate=True)
+    if not targets:
+        printe('No {kind}:{flavor} containers to roll out.'.format(
+            kind=kind, flavor=flavor))
+    wave_size = max_surge + max_unavailable
+    waves = [targets[i:i + wave_size]
+             for i in range(0, len(targets), wave_size)]
+    for number, wave in enumerate(waves, 1):
+        started = Utils.epoch()
+        replacements = [Replacement(config_manager, kind, flavor, machine,
+                                    name, surge=index < max_surge)
+                        for index, (machine, name) in enumerate(wave)]
+        ready = all(Utils.parallel(Replacement.start, replacements))
+        if ready:
+            # One events stream per machine covers the whole wave.
+            waiting = {}
+            for replacement in replacements:
+                waiting.setdefault(replacement.machine, []).append(
+                    replacement.new.name)
+            ready = not any(Utils.parallel(
+                lambda machine: DockerContainer(False, machine).wait(
+                    *waiting[machine], timeout=timeout), list(waiting)))
+        names = ', '.join(str(replacement) for replacement in replacements)
+        if not ready:
+            problems = Utils.parallel(Replacement.rollback, replacements)
+            for replacement, problem in zip(replacements, problems):
+                if problem:
+                    printe('{replacement}: {problem}'.format(
+                        replacement=replacement, problem=problem))
+            printe('Wave {number}/{total} ({names}) failed after {time:.1f}s '
+                   'and was rolled back.'.format(
+                       number=number, total=len(waves), names=names,
+                       time=Utils.epoch() - started), terminate=True)
+        problems = Utils.parallel(Replacement.commit, replacements)
+        if any(problems):
+            for replacement, problem in zip(replacements, problems):
+                if problem:
+                    printe('{replacement}: {problem}'.format(
+                        replacement=replacement, problem=problem))
+            printe('Wave {number}/{total} ({names}) came up but could not be '
+                   'finished.'.format(number=number, total=len(waves),
+                                      names=names), terminate=True)
+        print('Wave {number}/{total} ({names}) replaced in {time:.1f}s.'
+              .format(number=number, total=len(waves), names=names,
+                      time=Utils.epoch() - started), flush=True)
+    restage(config_manager, kind, flavor, machines)
+
+
 action_mappings = {
     'create': DockerContainer.create,
     'desc': ConfigManager.describe,
+    'down': down,
     'describe': ConfigManager.describe,
     'sh': DockerContainer.shell,
     'shell': DockerContainer.shell,
@@ -207,16 +897,23 @@ action_mappings = {
     'kinds': ConfigManager.listContainers,
     'logs': DockerContainer.logs,
     'ps': DockerContainer.processes,
+    'prestage': prestage,
     'processes': DockerContainer.processes,
+    'promote': promote,
     'remove': DockerContainer.remove,
     'rm': DockerContainer.remove,
     'run': DockerContainer.create,
+    'rollout': rollout,
     'running': DockerContainer.is_running,
     'stop': DockerContainer.stop,
-    'start': DockerContainer.start
+    'start': DockerContainer.start,
+    'stats': stats,
+    'validate': validate,
+    'wait': DockerContainer.wait,
 }
 
-actions_without_name = ['images', 'kinds', 'ps', 'processes', 'logs']
+actions_without_name = ['images', 'kinds', 'ps', 'processes', 'logs',
+                        'validate', 'down', 'stats']
 
 
 if __name__ == '__main__':
@@ -237,6 +934,49 @@ if __name__ == '__main__':
     parser.add_argument('-H', '--url', default=os.environ.get('DOCKER_HOST'),
                         help='The machine URL in which this container is '
                              'located.')
+    parser.add_argument('-M', '--machines',
+                        help='Comma separated machines to act on, if '
+                             'supported. Use "all" for every docker-machine '
+                             'and "local" for the local daemon.')
+    parser.add_argument('--max-surge', dest='max_surge', type=int, default=1,
+                        help='For rollout, how many replacements may run '
+                             'beside the containers they replace.')
+    parser.add_argument('--max-unavailable', dest='max_unavailable',
+                        type=int, default=0,
+                        help='For rollout, how many containers may be down '
+                             'at once while being replaced.')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='Seconds to wait for containers to be ready.')
+    parser.add_argument('-a', '--all', dest='all', action='store_true',
+                        help='For down, remove every container.')
+    parser.add_argument('-g', '--grace', type=int, default=10,
+                        help='For down, seconds containers get to stop before '
+                             'they are killed.')
+    parser.add_argument('-v', '--volumes', action='store_true',
+                        help='For down, also remove the containers\' '
+                             'anonymous volumes.')
+    parser.add_argument('-c', '--count', type=int, default=1,
+                        help='For prestage and promote, how many standby '
+                             'containers to keep per machine.')
+    parser.add_argument('--window', type=int, default=60,
+                        help='For stats, how many recent samples per '
+                             'container the aggregates cover.')
+    parser.add_argument('--interval', type=float, default=5,
+                        help='For stats, seconds between reports.')
+    parser.add_argument('--duration', type=float,
+                        help='For stats, seconds to sample for. Runs until '
+                             'interrupted if not given.')
+    parser.add_argument('--export',
+                        help='For stats, a file to append every sample to as '
+                             'JSON lines.')
+    parser.add_argument('--prune', action='store_true',
+                        help='For images, remove the images no config uses.')
+    parser.add_argument('--dry-run', dest='dry_run', action='store_true',
+                        help='Print what would be removed instead of removing '
+                             'it.')
+    parser.add_argument('-w', '--wait', action='store_true',
+                        help='For run and start, wait until the container is '
+                             'running, and healthy if it has a health check.')
     parser.add_argument('--no-debug', dest='debug', action='store_const',
                         const=False, help='Disable debug mode.')
     parser.add_argument('action', choices=action_mappings,
@@ -249,7 +989,10 @@ if __name__ == '__main__':
                              'determined by the kinds in the config '
                              'directory. Use the actions "kinds" to look up '
                              'all available options.')
-    args = parser.parse_args()
+    parser.add_argument('names', nargs='*',
+                        help='More container names, for actions that take '
+                             'several.')
+    args = parser.parse_intermixed_args()
 
     if args.debug is True:
         os.environ['UTILS_DEBUG'] = 'true'
@@ -269,6 +1012,20 @@ if __name__ == '__main__':
         printe('Container name required for action "{action}".'.format(
             args.action), terminate=2)
 
+    if args.action == 'validate':
+        (errors, warnings) = validate(args.config_directory)
+        for warning in warnings:
+            print('Warning: %s' % warning)
+        for error in errors:
+            print(error)
+        if errors:
+            printe('Found {count} problem(s) in {directory}.'.format(
+                count=len(errors), directory=args.config_directory),
+                terminate=3)
+        printe('All configs in {directory} are valid.'.format(
+            directory=args.config_directory))
+        sys.exit()
+
     config_manager = ConfigManager(args.config_directory, filter='container')
     if args.action in ('run', 'create', 'describe', 'desc'):
         # if not args.machine and args.host:
@@ -284,21 +1041,35 @@ if __name__ == '__main__':
             kind_and_flavor = args.name
         (kind, _, flavor) = kind_and_flavor.partition(':')
         if args.action == 'create' or args.action == 'run':
-            config = config_manager.getContainerConfig(kind, flavor)
             if not args.machine and args.url:
-                args.machine = DockerMachine(url=args.url)
-            container_config = dict(config)
-            for key in required_fields + required_container_fields:
-                if key in container_config:
-                    del container_config[key]
-            container_config['run'] = args.action == 'run'
-            DockerContainer(args.name, args.machine).create(
-                config['image'],
-                *config['command'],
-                **container_config,
-            )
+                args.machine = DockerMachine(url=args.url).name
+            create_from_config(config_manager, args.name, args.machine,
+                               kind, flavor, run=args.action == 'run',
+                               detach=args.action == 'run' and args.wait)
+            if args.action == 'run' and args.wait:
+                wait_for(DockerContainer(args.name, args.machine),
+                         timeout=args.timeout)
         else:
             print(config_manager.describeContainer(kind, flavor))
+    elif args.action == 'rollout':
+        (kind, _, flavor) = args.name.partition(':')
+        rollout(config_manager, kind, flavor,
+                machine_names(args.machines, args.machine),
+                max_surge=args.max_surge,
+                max_unavailable=args.max_unavailable,
+                timeout=args.timeout)
+    elif args.action == 'prestage':
+        (kind, _, flavor) = args.name.partition(':')
+        prestage(config_manager, kind, flavor,
+                 machine_names(args.machines, args.machine), count=args.count)
+    elif args.action == 'promote':
+        if not vars(args)['kind:flavor']:
+            printe('No kind provided for action "promote".')
+            printe(parser.format_usage(), terminate=2)
+        (kind, _, flavor) = vars(args)['kind:flavor'].partition(':')
+        promote(config_manager, args.config_directory, args.name, kind,
+                flavor, machine=args.machine, count=args.count,
+                wait=args.wait, timeout=args.timeout)
     elif args.action == 'kinds':
         printe("Here's a list of available kinds to create containers from:",
                flush=True)
@@ -310,6 +1081,29 @@ if __name__ == '__main__':
             DockerContainer(False, args.name).logs()
         else:
             DockerContainer(args.name, args.machine).logs()
+    elif args.action == 'down':
+        targets = [args.name, vars(args)['kind:flavor']] + args.names
+        targets = [target for target in targets if target]
+        if not targets and not args.all:
+            printe('Action "down" needs container names, globs or kinds, or '
+                   '--all.', terminate=2)
+        down(machine_names(args.machines, args.machine), targets,
+             grace=args.grace, volumes=args.volumes)
+    elif args.action == 'stats':
+        targets = [args.name, vars(args)['kind:flavor']] + args.names
+        export = open(args.export, 'a') if args.export else None
+        try:
+            stats(machine_names(args.machines, args.machine),
+                  [target for target in targets if target],
+                  window=args.window, interval=args.interval,
+                  duration=args.duration, export=export)
+        finally:
+            if export is not None:
+                export.close()
+    elif args.action == 'images' and (args.machines or args.prune):
+        images_report(config_manager,
+                      machine_names(args.machines, args.machine),
+                      prune=args.prune, dry_run=args.dry_run)
     elif args.action in actions_without_name:
         if not args.machine:
             print(action_mappings[args.action](DockerContainer(False,
@@ -317,6 +1111,14 @@ if __name__ == '__main__':
         else:
             print(action_mappings[args.action](DockerContainer(args.name,
                                                                args.machine)))
+    elif args.action == 'wait':
+        names = [args.name, vars(args)['kind:flavor']] + args.names
+        wait_for(DockerContainer(args.name, args.machine),
+                 *[name for name in names if name], timeout=args.timeout)
+    elif args.action == 'start' and args.wait:
+        print(DockerContainer(args.name, args.machine).start())
+        wait_for(DockerContainer(args.name, args.machine),
+                 timeout=args.timeout)
     elif args.action == 'rm' or args.action == 'remove':
         print(DockerContainer(args.name,
                               args.machine).remove(stop_if_running=args.force))
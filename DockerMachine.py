@@ -92,6 +92,23 @@ class DockerMachine(object):
     def ip(self):
         return CommandBuilder('docker-machine', 'ip', self.name).run()
 
+    # Connection arguments for each machine's daemon, looked up once per run.
+    daemon_configs = {}
+
+    def docker_command(self):
+        """Returns a docker CommandBuilder addressing this machine's daemon"""
+        if self.local:
+            return CommandBuilder('docker')
+        if self.name not in DockerMachine.daemon_configs:
+            config = self.config()
+            if config is None:
+                printe('Could not get the connection config of machine '
+                       '"{name}". Is it a docker-machine that is running?'
+                       .format(name=self.name), terminate=True)
+            DockerMachine.daemon_configs[self.name] = config
+        return CommandBuilder('docker',
+                              *DockerMachine.daemon_configs[self.name])
+
     def env(self):
         command = CommandBuilder('docker-machine', 'env')
         if self.local:
@@ -103,8 +120,10 @@ class DockerMachine(object):
     def config(self):
         if self.local:
             return False
-        return CommandBuilder('docker-machine', 'config',
-                              self.name).run().split()
+        output = CommandBuilder('docker-machine', 'config', self.name).run()
+        if output is None:
+            return None
+        return output.split()
 
     def remove(self):
         if self.local:
@@ -132,6 +151,10 @@ class DockerMachine(object):
         return CommandBuilder('docker-machine',
                               'ls').run(replaceForeground=True)
 
+    def names():
+        output = CommandBuilder('docker-machine', 'ls', '--quiet').run()
+        return [name for name in (output or '').split('\n') if name]
+
 action_mappings = {
     'config': DockerMachine.config,
     'create': DockerMachine.create,
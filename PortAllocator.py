@@ -0,0 +1,200 @@
+import re
+import threading
+import Utils
+from CommandBuilder import CommandBuilder
+from Utils import printe
+
+# Host ports handed out for "auto" ports, matching Docker's ephemeral range.
+auto_port_range = (32768, 60999)
+
+# A port spec as written in container configs: [ip:][host]:container[/proto]
+# where host may also be "auto" or a "low-high" range to allocate from.
+port_pattern = re.compile(
+    r'^(?:(?P<ip>\[[0-9a-fA-F:.]+\]|[^:\[\]]+):)?'
+    r'(?P<host>auto|[0-9]+(?:-[0-9]+)?)?:'
+    r'(?P<container>[0-9]+(?:-[0-9]+)?)'
+    r'(?P<protocol>/(?:tcp|udp|sctp))?$')
+
+# Matches the host side of a published port in `docker ps` output, e.g.
+# "0.0.0.0:8000-8001->80-81/tcp".
+published_port_pattern = re.compile(r':([0-9]+)(?:-([0-9]+))?->')
+
+
+def port_range(ports):
+    low, _, high = ports.partition('-')
+    return (int(low), int(high or low))
+
+
+def parse_port(port):
+    """
+    Returns the match for a port spec, or None if it is malformed. Docker
+    maps a host range onto a container range port by port, so both must be
+    the same length, and "auto" picks a single port for a single port.
+    """
+    if not isinstance(port, str):
+        return None
+    match = port_pattern.match(port)
+    if match is None:
+        return None
+    container = port_range(match.group('container'))
+    if container[0] > container[1]:
+        return None
+    host = match.group('host')
+    if host is None:
+        return match
+    if host == 'auto':
+        return match if container[0] == container[1] else None
+    host = port_range(host)
+    if host[0] > host[1]:
+        return None
+    if container[0] != container[1] \
+            and host[1] - host[0] != container[1] - container[0]:
+        return None
+    return match
+
+
+def needs_allocation(port):
+    match = parse_port(port)
+    if match is None or match.group('host') is None:
+        return False
+    if match.group('host') == 'auto':
+        return True
+    host = port_range(match.group('host'))
+    container = port_range(match.group('container'))
+    return host[0] != host[1] and container[0] == container[1]
+
+
+class PortAllocator(object):
+
+    def __init__(self, machine=None):
+        self.machine = machine
+        self.lock = threading.Lock()
+        self.used = None
+        # Host ports bound right now, as opposed to ones only reserved.
+        self.bound = None
+        # Next candidate port for each allocation range. Cursors only move
+        # forward, so each allocation is amortized O(1).
+        self.cursors = {}
+
+    def base_command(self):
+        if self.machine is None:
+            return CommandBuilder('docker')
+        return self.machine.docker_command()
+
+    def load(self):
+        output = self.base_command().append('ps', '--format',
+                                            '{{.Ports}}').run()
+        self.used = set()
+        for match in published_port_pattern.finditer(output or ''):
+            low = int(match.group(1))
+            high = int(match.group(2) or low)
+            self.used.update(range(low, high + 1))
+        self.bound = set(self.used)
+        # Containers created but never started, such as standbys, publish
+        # nothing yet but will claim their ports once started.
+        if Utils.debugging():
+            return
+        created = self.base_command().append('ps', '--all', '--quiet',
+                                             '--filter',
+                                             'status=created').run()
+        created = [container for container in (created or '').split('\n')
+                   if container]
+        if not created:
+            return
+        output = self.base_command().append(
+            'inspect', '--format',
+            '{{range $port, $bindings := .HostConfig.PortBindings}}'
+            '{{range $bindings}}{{.HostPort}} {{end}}{{end}}',
+            *created).run()
+        for port in (output or '').split():
+            if port.isdigit():
+                self.used.add(int(port))
+
+    def next_free(self, low, high):
+        cursor = self.cursors.get((low, high), low)
+        while cursor <= high and cursor in self.used:
+            cursor += 1
+        if cursor > high:
+            return None
+        self.cursors[(low, high)] = cursor + 1
+        self.used.add(cursor)
+        return cursor
+
+    def release(self, allocated):
+        for allocation_range, port in allocated:
+            self.used.discard(port)
+            if allocation_range is not None:
+                self.cursors[allocation_range] = min(
+                    self.cursors[allocation_range], port)
+
+    def allocate(self, *ports, bind=False):
+        """
+        Resolves "auto" and ranged host ports to free ones. The whole batch
+        is reserved atomically: either every port gets a host port or none.
+        With bind, fixed host ports that are already bound are an error,
+        since the container is about to be started.
+        """
+        resolved = []
+        with self.lock:
+            if self.used is None:
+                self.load()
+            allocated = []
+            for port in ports:
+                match = parse_port(port)
+                if match is None:
+                    resolved += [port]
+                    continue
+                if not needs_allocation(port):
+                    if match.group('host') is not None:
+                        (low, high) = port_range(match.group('host'))
+                        fixed = range(low, high + 1)
+                        taken = [fixed_port for fixed_port in fixed
+                                 if fixed_port in self.bound or
+                                 (None, fixed_port) in allocated]
+                        if bind and taken:
+                            self.release(allocated)
+                            printe('Error: Host port {taken} for port '
+                                   '"{port}" is already in use.'.format(
+                                       taken=taken[0], port=port),
+                                   terminate=True)
+                        for fixed_port in fixed:
+                            if fixed_port not in self.used:
+                                self.used.add(fixed_port)
+                                allocated += [(None, fixed_port)]
+                    resolved += [port]
+                    continue
+                if match.group('host') == 'auto':
+                    (low, high) = auto_port_range
+                else:
+                    (low, high) = port_range(match.group('host'))
+                host_port = self.next_free(low, high)
+                if host_port is None:
+                    self.release(allocated)
+                    printe('Error: No free host port left in {low}-{high} '
+                           'for port "{port}".'.format(low=low, high=high,
+                                                       port=port),
+                           terminate=True)
+                allocated += [((low, high), host_port)]
+                ip = match.group('ip')
+                resolved += ['{ip}{host}:{container}{protocol}'.format(
+                    ip=ip + ':' if ip else '',
+                    host=host_port,
+                    container=match.group('container'),
+                    protocol=match.group('protocol') or '',
+                )]
+            if bind:
+                self.bound.update(port for _, port in allocated)
+        return resolved
+
+
+allocators = {}
+allocators_lock = threading.Lock()
+
+
+def for_machine(machine=None):
+    """Returns the shared allocator for a machine, so batches see each other"""
+    key = machine.name if machine is not None else None
+    with allocators_lock:
+        if key not in allocators:
+            allocators[key] = PortAllocator(machine)
+        return allocators[key]
@@ -0,0 +1,142 @@
+import collections
+import json
+import re
+import threading
+import Utils
+from CommandBuilder import CommandBuilder
+from DockerMachine import DockerMachine
+
+# Terminal escapes `docker stats` prints between frames.
+escape_pattern = re.compile(r'\x1b\[[0-9;]*[A-Za-z]')
+
+metrics = ['cpu', 'memory', 'net', 'block']
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    index = int(round(fraction * (len(values) - 1)))
+    return values[index]
+
+
+def io_total(io):
+    """Adds up the two sides of an I/O column, e.g. "1.2kB / 3.4MB" """
+    return sum(Utils.parse_size(side) for side in io.split('/'))
+
+
+class StatsSampler(object):
+    """
+    Follows `docker stats` for containers on several machines, keeping the
+    last `window` samples of each metric per container so memory stays
+    bounded however long it runs. Network and block I/O are kept as rates.
+    """
+
+    def __init__(self, window=60, export=None):
+        self.window = window
+        self.export = export
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.groups = {}
+        self.totals = {}
+        self.processes = []
+
+    def record(self, machine, line, when):
+        fields = escape_pattern.sub('', line).strip().split('\t')
+        if len(fields) != 5 or (machine, fields[0]) not in self.groups:
+            return
+        (name, cpu, memory, net, block) = fields
+        key = (machine, name)
+        try:
+            cpu = float(cpu.rstrip('%'))
+        except ValueError:
+            # Stopped containers show "--" instead of numbers.
+            return
+        memory = Utils.parse_size(memory.split('/')[0])
+        totals = (when, io_total(net), io_total(block))
+        with self.lock:
+            previous = self.totals.get(key)
+            self.totals[key] = totals
+            if previous is None or when <= previous[0]:
+                return
+            elapsed = when - previous[0]
+            sample = {
+                'cpu': cpu,
+                'memory': memory,
+                'net': max(0, totals[1] - previous[1]) / elapsed,
+                'block': max(0, totals[2] - previous[2]) / elapsed,
+            }
+            buffers = self.samples.setdefault(key, dict(
+                (metric, collections.deque(maxlen=self.window))
+                for metric in metrics))
+            for metric in metrics:
+                buffers[metric].append(sample[metric])
+            if self.export is not None:
+                sample.update(time=when, machine=machine or 'local',
+                              container=name, group=self.groups.get(key))
+                self.export.write(json.dumps(sample) + '\n')
+                self.export.flush()
+
+    def follow(self, machine, containers):
+        """Streams stats for (name, group) pairs on one machine"""
+        if not containers:
+            return
+        for name, group in containers:
+            self.groups[(machine, name)] = group
+        if machine is None:
+            command = CommandBuilder('docker')
+        else:
+            command = DockerMachine(machine).docker_command()
+        process = command.append(
+            'stats', '--format',
+            '{{.Name}}\t{{.CPUPerc}}\t{{.MemUsage}}\t{{.NetIO}}\t'
+            '{{.BlockIO}}', *[name for name, _ in containers]).stream()
+        if process is None:
+            return
+        self.processes += [process]
+
+        def read():
+            for line in process.stdout:
+                try:
+                    self.record(machine, line, Utils.epoch())
+                except Exception:
+                    # One odd row must not stop sampling the whole machine.
+                    continue
+        threading.Thread(target=read, daemon=True).start()
+
+    def stop(self):
+        for process in self.processes:
+            process.kill()
+            process.wait()
+
+    def report(self):
+        """Returns rolling p50/p95/max of each metric by kind:flavor"""
+        with self.lock:
+            grouped = {}
+            for key, buffers in self.samples.items():
+                values = grouped.setdefault(self.groups.get(key), dict(
+                    (metric, []) for metric in metrics))
+                for metric in metrics:
+                    values[metric] += buffers[metric]
+                values.setdefault('containers', set()).add(key)
+        row = '{group:<24}  {count:>4}  {cpu:>20}  {memory:>26}  ' \
+              '{net:>26}  {block:>26}'
+        lines = [row.format(group='KIND:FLAVOR', count='#',
+                            cpu='CPU% p50/p95/max',
+                            memory='MEM p50/p95/max',
+                            net='NET/s p50/p95/max',
+                            block='BLOCK/s p50/p95/max')]
+        for group in sorted(grouped):
+            values = grouped[group]
+            columns = {}
+            for metric in metrics:
+                ordered = sorted(values[metric])
+                points = (percentile(ordered, 0.5),
+                          percentile(ordered, 0.95), ordered[-1])
+                if metric == 'cpu':
+                    columns[metric] = '/'.join('%.1f' % point
+                                               for point in points)
+                else:
+                    columns[metric] = '/'.join(Utils.format_size(point)
+                                               for point in points)
+            lines += [row.format(group=group, count=len(values['containers']),
+                                 **columns)]
+        return '\n'.join(lines)
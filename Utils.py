@@ -5,6 +5,7 @@ import sys
 import subprocess
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 
 class Utils(object):
@@ -22,9 +23,11 @@ class Utils(object):
         print(' '.join(command_args))
         return '$(%s)' % ' '.join(command_args)
 
+    def debugging():
+        return os.environ.get('UTILS_DEBUG') in ('true', 'True')
+
     def run(*command_args, terminate_on_fail=False, replaceForeground=False):
-        if os.environ.get('UTILS_DEBUG') == 'true' \
-                or os.environ.get('UTILS_DEBUG') == 'True':
+        if Utils.debugging():
             return Utils.debug(*command_args,
                                terminate_on_fail=terminate_on_fail)
         try:
@@ -47,6 +50,44 @@ class Utils(object):
                 printe('Exited without valid error code.')
             printe(end='', terminate=exit_status)
 
+    def stream(*command_args):
+        """Starts a command and returns its process to read output from"""
+        if Utils.debugging():
+            Utils.debug(*command_args)
+            return None
+        return subprocess.Popen(command_args, stdout=subprocess.PIPE,
+                                universal_newlines=True, bufsize=1)
+
+    def background(*command_args):
+        """Starts a command detached from this process, without waiting"""
+        if Utils.debugging():
+            return Utils.debug(*command_args)
+        subprocess.Popen(command_args, stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL, start_new_session=True)
+
+    # Multipliers for the size units docker prints, both SI and binary.
+    size_units = {
+        'B': 1,
+        'kB': 1000, 'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3,
+        'TB': 1000 ** 4,
+        'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3, 'TiB': 1024 ** 4,
+    }
+
+    def parse_size(size):
+        """Converts a docker size such as "1.5MiB" or "142MB" to bytes"""
+        match = re.match(r'^\s*([0-9.]+)\s*([a-zA-Z]*)\s*$', size or '')
+        if not match or match.group(2) not in Utils.size_units:
+            return 0
+        return float(match.group(1)) * Utils.size_units[match.group(2)]
+
+    def format_size(size):
+        for unit in ('B', 'kB', 'MB', 'GB'):
+            if abs(size) < 1000:
+                return '%.1f%s' % (size, unit)
+            size /= 1000
+        return '%.1fTB' % size
+
     """Returns the terminal size as an array of [ rows, columns ]"""
     def terminal_size():
         result = run('stty', 'size').split()
@@ -56,10 +97,24 @@ class Utils(object):
             except:
                 return [-1, -1]
 
+    def parallel(function, items, workers=None):
+        """Calls function on each item concurrently, keeping their order"""
+        items = list(items)
+        if len(items) <= 1:
+            return [function(item) for item in items]
+        with ThreadPoolExecutor(max_workers=workers or len(items)) as executor:
+            return list(executor.map(function, items))
+
     epoch = time.time
 
 printe = error = Utils.printe
 run = Utils.run
 debug = Utils.debug
+debugging = Utils.debugging
+stream = Utils.stream
+background = Utils.background
+parse_size = Utils.parse_size
+format_size = Utils.format_size
 epoch = Utils.epoch
 terminal_size = Utils.terminal_size
+parallel = Utils.parallel
@@ -0,0 +1,126 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import ConfigManager
+from ConfigManager import validate
+
+
+def container(name, kind, flavor='prod', **fields):
+    config = {
+        'name': name,
+        'description': 'A test container',
+        'type': 'container',
+        'kind': kind,
+        'flavor': flavor,
+        'image': 'alpine',
+    }
+    config.update(fields)
+    return config
+
+
+class ValidateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, file_name, config):
+        with open(os.path.join(self.directory, file_name), 'w') as file:
+            if isinstance(config, str):
+                file.write(config)
+            else:
+                json.dump(config, file)
+
+    def test_valid_directory(self):
+        self.write('db.json', container('db', 'db'))
+        self.write('web.json', container('web', 'web', links=['db:db'],
+                                         ports=['auto:80']))
+        self.assertEqual(validate(self.directory, workers=1), ([], []))
+
+    def test_reports_every_error(self):
+        self.write('a.json', '{not json')
+        self.write('b.json', container('b', 'b', ports=['x:80']))
+        self.write('c.json', container('c', 'c', links=['nolias']))
+        (errors, _) = validate(self.directory, workers=1)
+        self.assertEqual(len(errors), 3)
+
+    def test_duplicate_kind_and_flavor(self):
+        self.write('a.json', container('a', 'web'))
+        self.write('b.json', container('b', 'web'))
+        self.write('c.json', container('c', 'web', flavor='dev'))
+        (errors, _) = validate(self.directory, workers=1)
+        self.assertEqual(errors, ['Duplicate kind:flavor configs found: '
+                                  'a.json b.json.'])
+
+    def test_non_string_fields(self):
+        self.write('a.json', container('a', ['web'], links='db:db'))
+        (errors, _) = validate(self.directory, workers=1)
+        self.assertTrue(errors)
+
+    def test_unknown_link_targets_are_warnings(self):
+        self.write('web.json', container('web', 'web', links=['db:db'],
+                                         **{'volumes-from': 'data:ro'}))
+        (errors, warnings) = validate(self.directory, workers=1)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(warnings), 2)
+
+    def test_unchanged_files_come_from_the_cache(self):
+        self.write('a.json', container('a', 'a', ports=['x:80']))
+        first = validate(self.directory, workers=1)
+        with mock.patch('ConfigManager.validate_files') as validate_files:
+            self.assertEqual(validate(self.directory, workers=1), first)
+        validate_files.assert_not_called()
+
+    def test_changed_files_are_checked_again(self):
+        self.write('a.json', container('a', 'a', ports=['x:80']))
+        self.write('b.json', container('b', 'b'))
+        self.assertEqual(len(validate(self.directory, workers=1)[0]), 1)
+        self.write('a.json', container('a', 'a', ports=['8080:80']))
+        checked = []
+
+        def validate_files(files):
+            checked.extend(config for config, _ in files)
+            return [ConfigManager.validate_file(config, text)
+                    for config, text in files]
+        with mock.patch('ConfigManager.validate_files', validate_files):
+            self.assertEqual(validate(self.directory, workers=1), ([], []))
+        self.assertEqual(checked, ['a.json'])
+
+    def test_renamed_files_are_checked_again(self):
+        self.write('a.json', container('a', 'a'))
+        validate(self.directory, workers=1)
+        os.rename(os.path.join(self.directory, 'a.json'),
+                  os.path.join(self.directory, 'b.json'))
+        with mock.patch('ConfigManager.validate_files',
+                        return_value=[{'errors': ['checked']}]):
+            self.assertEqual(validate(self.directory, workers=1)[0],
+                             ['checked'])
+
+    def test_cache_from_another_version_is_ignored(self):
+        self.write('a.json', container('a', 'a'))
+        validate(self.directory, workers=1)
+        with mock.patch('ConfigManager.validation_version', 'other'), \
+                mock.patch('ConfigManager.validate_files',
+                           return_value=[{'errors': ['checked']}]):
+            self.assertEqual(validate(self.directory, workers=1)[0],
+                             ['checked'])
+
+    def test_worker_processes_give_the_same_results(self):
+        for index in range(8):
+            self.write('%d.json' % index,
+                       container(str(index), 'kind%d' % index,
+                                 ports=['x:80'] if index % 2 else []))
+        parallel = validate(self.directory, workers=2)
+        os.remove(os.path.join(self.directory,
+                               ConfigManager.validation_cache_file))
+        self.assertEqual(parallel, validate(self.directory, workers=1))
+        self.assertEqual(len(parallel[0]), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
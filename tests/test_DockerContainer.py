@@ -0,0 +1,79 @@
+import unittest
+from unittest import mock
+from DockerContainer import image_inventory, image_reference
+
+
+class ImageReferenceTest(unittest.TestCase):
+
+    def test_defaults_to_latest(self):
+        self.assertEqual(image_reference('nginx'), 'nginx:latest')
+
+    def test_keeps_the_tag(self):
+        self.assertEqual(image_reference('nginx:1.25'), 'nginx:1.25')
+
+    def test_strips_docker_hub_prefixes(self):
+        self.assertEqual(image_reference('docker.io/library/nginx:1.25'),
+                         'nginx:1.25')
+        self.assertEqual(image_reference('library/nginx'), 'nginx:latest')
+        self.assertEqual(image_reference('docker.io/bitnami/redis'),
+                         'bitnami/redis:latest')
+
+    def test_registry_port_is_not_a_tag(self):
+        self.assertEqual(image_reference('localhost:5000/app'),
+                         'localhost:5000/app:latest')
+        self.assertEqual(image_reference('localhost:5000/app:2'),
+                         'localhost:5000/app:2')
+
+    def test_digest(self):
+        self.assertEqual(image_reference('nginx@sha256:abc'),
+                         'nginx@sha256:abc')
+        self.assertEqual(
+            image_reference('docker.io/library/nginx:1.25@sha256:abc'),
+            'nginx@sha256:abc')
+
+
+class ImageInventoryTest(unittest.TestCase):
+
+    images = '\n'.join('\t'.join(row) for row in [
+        ('nginx', '<none>', 'sha256:abc', 'sha256:1', '100MB', '2024'),
+        ('nginx', '1.24', '<none>', 'sha256:2', '90MB', '2024'),
+        ('redis', '6', '<none>', 'sha256:3', '50MB', '2024'),
+        ('busybox', 'latest', '<none>', 'sha256:4', '1MB', '2024'),
+    ])
+
+    def inventory(self, images):
+        config_manager = mock.Mock()
+        config_manager.listContainers.return_value = ['web:prod',
+                                                      'cache:prod']
+        config_manager.getContainerConfig.side_effect = \
+            lambda kind, flavor: {'image': images[kind]}
+        with mock.patch('DockerContainer.DockerContainer.base_command') \
+                as base_command:
+            base_command.return_value.append.return_value.run.return_value \
+                = self.images
+            return dict((image['id'], image)
+                        for image in image_inventory(config_manager, [None]))
+
+    def test_digest_pinned_config_matches_by_digest(self):
+        inventory = self.inventory({'web': 'nginx@sha256:abc',
+                                    'cache': 'redis:6'})
+        self.assertEqual(inventory['1']['configs'], ['web:prod'])
+        self.assertEqual(inventory['1']['references'], ['nginx@sha256:abc'])
+        self.assertEqual(inventory['2']['configs'], [])
+        self.assertEqual(inventory['3']['configs'], ['cache:prod'])
+
+    def test_unresolved_config_keeps_its_repository(self):
+        inventory = self.inventory({'web': 'nginx@sha256:abc',
+                                    'cache': 'redis:7'})
+        self.assertEqual(inventory['3']['configs'], [])
+        self.assertEqual(inventory['3']['maybe'], ['cache:prod'])
+        self.assertEqual(inventory['4']['maybe'], [])
+
+    def test_removes_by_tag_or_id(self):
+        inventory = self.inventory({'web': 'nginx', 'cache': 'redis'})
+        self.assertEqual(inventory['1']['machines'], {None: ['sha256:1']})
+        self.assertEqual(inventory['2']['machines'], {None: ['nginx:1.24']})
+
+
+if __name__ == '__main__':
+    unittest.main()
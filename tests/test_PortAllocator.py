@@ -0,0 +1,98 @@
+import unittest
+from PortAllocator import PortAllocator, needs_allocation, parse_port
+
+
+class ParsePortTest(unittest.TestCase):
+
+    def test_valid(self):
+        for port in (':80', '8080:80', 'auto:80', '8000-8010:80',
+                     '8000-8001:80-81', '127.0.0.1:8080:80/udp',
+                     '[::1]:auto:53/tcp', '127.0.0.1::80'):
+            self.assertIsNotNone(parse_port(port), port)
+
+    def test_malformed(self):
+        # Like docker -p, but the host side needs its colon.
+        for port in (80, '80', None, '', 'auto', 'x:80', '80:', '8080:80/icmp',
+                     '8010-8000:80', '80:90-81'):
+            self.assertIsNone(parse_port(port), port)
+
+    def test_auto_needs_a_single_container_port(self):
+        self.assertIsNone(parse_port('auto:80-81'))
+
+    def test_ranges_must_be_the_same_length(self):
+        self.assertIsNone(parse_port('8000-8002:80-81'))
+        self.assertIsNone(parse_port('8000:80-81'))
+
+    def test_needs_allocation(self):
+        self.assertTrue(needs_allocation('auto:80'))
+        self.assertTrue(needs_allocation('8000-8010:80'))
+        self.assertFalse(needs_allocation('8080:80'))
+        self.assertFalse(needs_allocation('8000-8001:80-81'))
+        self.assertFalse(needs_allocation('80'))
+        self.assertFalse(needs_allocation('auto:80-81'))
+
+
+class AllocateTest(unittest.TestCase):
+
+    def allocator(self, used=(), bound=()):
+        allocator = PortAllocator()
+        allocator.used = set(used)
+        allocator.bound = set(bound)
+        return allocator
+
+    def test_ranges_skip_used_ports(self):
+        allocator = self.allocator(used=[8000, 8001])
+        self.assertEqual(allocator.allocate('8000-8010:80', '8000-8010:81'),
+                         ['8002:80', '8003:81'])
+
+    def test_keeps_ip_and_protocol(self):
+        allocator = self.allocator()
+        self.assertEqual(allocator.allocate('127.0.0.1:9000-9001:53/udp'),
+                         ['127.0.0.1:9000:53/udp'])
+
+    def test_auto(self):
+        allocator = self.allocator()
+        (port,) = allocator.allocate('auto:80')
+        self.assertTrue(port.endswith(':80'))
+        self.assertIn(int(port.partition(':')[0]), allocator.used)
+
+    def test_fixed_and_malformed_ports_pass_through(self):
+        allocator = self.allocator()
+        self.assertEqual(allocator.allocate('8080:80', 'x:80'),
+                         ['8080:80', 'x:80'])
+        self.assertIn(8080, allocator.used)
+
+    def test_exhausted_range_releases_the_batch(self):
+        allocator = self.allocator(used=[8001])
+        with self.assertRaises(SystemExit):
+            allocator.allocate('8000-8001:80', '8080:81', '8000-8001:82')
+        self.assertEqual(allocator.used, {8001})
+        self.assertEqual(allocator.allocate('8000-8001:80'), ['8000:80'])
+
+    def test_bound_fixed_port_conflicts_when_binding(self):
+        allocator = self.allocator(used=[8080], bound=[8080])
+        with self.assertRaises(SystemExit):
+            allocator.allocate('9000-9001:80', '8080:81', bind=True)
+        self.assertEqual(allocator.used, {8080})
+        self.assertEqual(allocator.bound, {8080})
+
+    def test_bound_fixed_port_is_fine_without_binding(self):
+        allocator = self.allocator(used=[8080], bound=[8080])
+        self.assertEqual(allocator.allocate('8080:80'), ['8080:80'])
+
+    def test_fixed_port_twice_in_one_batch_conflicts(self):
+        allocator = self.allocator()
+        with self.assertRaises(SystemExit):
+            allocator.allocate('8080:80', '8080:81', bind=True)
+        self.assertEqual(allocator.used, set())
+
+    def test_binding_marks_ports_bound(self):
+        allocator = self.allocator()
+        allocator.allocate('8000-8010:80', '8080:81', bind=True)
+        self.assertEqual(allocator.bound, {8000, 8080})
+        with self.assertRaises(SystemExit):
+            allocator.allocate('8080:82', bind=True)
+
+
+if __name__ == '__main__':
+    unittest.main()